@@ -1,19 +1,36 @@
 import streamlit as st
 import pandas as pd
 import calendar as cal
-from fpdf import FPDF
-import tempfile
-import os
+from collections import Counter
+from itertools import cycle, islice, repeat
+from fpdf import FPDF, XPos, YPos
+import io
+import gc
+
+@st.cache_data(show_spinner=False)
+def load_excel(file_bytes):
+    """
+    Read only the route/vehicle columns of the uploaded workbook.
+    Uses the Rust-based calamine reader (much faster than openpyxl) and is
+    cached on the file bytes so reruns don't re-parse the same upload.
+    """
+    with io.BytesIO(file_bytes) as buf:
+        return pd.read_excel(buf, usecols=['RUTE NAME', 'GADI_NUMBER'], engine='calamine')
 
+@st.cache_data(show_spinner=False)
 def generate_block_timetable(data, year, month):
     """
     Generate block-style timetable:
     Each route has blocks of continuous dates with same vehicle.
+    Each block is {"start", "end", "plate", "holiday"}; holiday=True means
+    a backup vehicle covers the fixed vehicle's day off.
+    Returns (timetable_blocks, fixed_vehicles).
     (KEEPING LOGIC AS YOU PROVIDED — DO NOT CHANGE)
     """
 # --- Flexible assignment for any Excel change ---
-    routes = data['RUTE NAME'].dropna().tolist()
-    vehicles = data['GADI_NUMBER'].dropna().tolist()
+    # plain object arrays: no per-element list boxing, and slices below are views
+    routes = data['RUTE NAME'].dropna().to_numpy()
+    vehicles = data['GADI_NUMBER'].dropna().to_numpy()
 
 # Assign fixed vehicles = number of routes
     fixed_vehicle_count = len(routes)
@@ -22,176 +39,247 @@ def generate_block_timetable(data, year, month):
 
     days_in_month = cal.monthrange(year, month)[1]
 
-    # Pre-assign holidays for fixed vehicles
-    holidays = {v: [] for v in fixed_vehicles}
-    for i, v in enumerate(fixed_vehicles):
+    fixed = fixed_vehicles.tolist()
+    fixed_count = len(fixed)
+
+    # Pre-assign holidays for fixed vehicles (a plate listed twice shares one list)
+    holidays = {v: [] for v in fixed}
+    for i, v in enumerate(fixed):
         day = (i % 5) + 6
         while len(holidays[v]) < 5 and day <= days_in_month:
             holidays[v].append(day)
             day += 6
+    holidays = {v: sorted(set(days)) for v, days in holidays.items()}
+
+    # Each route keeps its fixed vehicle; holidays take backup vehicles in turn
+    # (route by route, day by day)
+    backup_iter = cycle(backup_vehicles) if len(backup_vehicles) else repeat("NONE")
 
     timetable_blocks = {}
-    backup_index = 0
 
-    for r_idx, route in enumerate(routes):
-        vehicle = fixed_vehicles[r_idx % len(fixed_vehicles)]
+    for r_idx, route in enumerate(routes.tolist()):
+        vehicle = fixed[r_idx % fixed_count]
         blocks = []
         start_day = 1
-        current_vehicle = vehicle
-
-        for day in range(1, days_in_month + 1):
-            # Check if vehicle changes (holiday)
-            if day in holidays[vehicle]:
-                assigned_vehicle = f"{backup_vehicles[backup_index]} (H)"
-                backup_index = (backup_index + 1) % len(backup_vehicles)
-            else:
-                assigned_vehicle = vehicle
-
-            # If vehicle changes, end previous block
-            if assigned_vehicle != current_vehicle:
-                blocks.append({"start": start_day, "end": day-1, "vehicle": current_vehicle})
-                current_vehicle = assigned_vehicle
-                start_day = day
-
-            # Handle last day
-            if day == days_in_month:
-                blocks.append({"start": start_day, "end": day, "vehicle": current_vehicle})
+
+        # walk only the holidays (not every day): each one ends the working
+        # block before it and starts a backup block of its own
+        for day in holidays[vehicle]:
+            plate = next(backup_iter)
+            if day > start_day:
+                blocks.append({"start": start_day, "end": day - 1, "plate": vehicle, "holiday": False})
+            elif blocks[-1]["holiday"] and blocks[-1]["plate"] == plate:
+                # back-to-back holidays covered by the same backup stay one block
+                blocks[-1]["end"] = day
+                start_day = day + 1
+                continue
+            blocks.append({"start": day, "end": day, "plate": plate, "holiday": True})
+            start_day = day + 1
+
+        # Handle the rest of the month
+        if start_day <= days_in_month:
+            blocks.append({"start": start_day, "end": days_in_month, "plate": vehicle, "holiday": False})
 
         timetable_blocks[route] = blocks
 
-    return timetable_blocks
+    return timetable_blocks, fixed
 
+@st.cache_data(show_spinner=False)
 def generate_summary(timetable_blocks, fixed_vehicles, days_in_month):
     """
     Summary: Count working days vs holidays for each vehicle
     (keeps your original semantics)
     """
-    summary = []
-    for v in fixed_vehicles:
-        work_days = 0
-        for route_blocks in timetable_blocks.values():
-            for block in route_blocks:
-                if v in block['vehicle'] and "(H)" not in block['vehicle']:
-                    work_days += block['end'] - block['start'] + 1
-        holidays = days_in_month - work_days
-        summary.append({"Vehicle": v, "Working Days": work_days, "Holidays": holidays})
+    # single pass over all blocks: working days per assigned vehicle
+    work_days = Counter()
+    for route_blocks in timetable_blocks.values():
+        for block in route_blocks:
+            if not block['holiday']:
+                work_days[block['plate']] += block['end'] - block['start'] + 1
+
+    summary = [{"Vehicle": v, "Working Days": work_days[v], "Holidays": days_in_month - work_days[v]}
+               for v in fixed_vehicles]
     return pd.DataFrame(summary)
 
+@st.cache_data(show_spinner=False)
+def to_csv_bytes(df):
+    """
+    Encode a DataFrame as CSV bytes for download.
+    Cached on the DataFrame contents so reruns don't re-encode it.
+    """
+    return df.to_csv(index=False).encode('utf-8')
+
 # ----------------- PDF layout----------------- #
+def make_row_drawer(columns_per_row, left_margin, page_width, gap, box_height,
+                    vehicle_baseline, date_baseline, assigned_colors, holiday_colors):
+    """
+    Build a row drawer specialized for one box layout.
+    Box width, every column's x position, the text baselines and the
+    (fill, text) colors are closure constants, so drawing a row is just a
+    zip over the precomputed positions.
+    draw_row(pdf, row, y, month_name, date_cache, parts, last_fill) takes the
+    holiday marker of the previous box (None = colors not set yet) and
+    returns the marker of the last box it drew.
+    """
+    # compute box width such that 'columns_per_row' fit in the page width with gaps
+    box_width = (page_width - (columns_per_row - 1) * gap) / columns_per_row
+    xs = tuple(left_margin + i * (box_width + gap) for i in range(columns_per_row))
+
+    def draw_row(pdf, row, y, month_name, date_cache, parts, last_fill):
+        for x, b in zip(xs, row):
+            # fill/text color based on holiday marker, switched only when it changes
+            is_h = b["holiday"]
+            if is_h != last_fill:
+                fill_color, text_color = holiday_colors if is_h else assigned_colors
+                pdf.set_fill_color(*fill_color)
+                pdf.set_text_color(*text_color)
+                last_fill = is_h
+
+            # draw rect with fill
+            pdf.rect(x, y, box_width, box_height, style="DF")
+
+            # write centered text inside the box: vehicle line, then smaller date line.
+            # text() places a string at a baseline, skipping cell()'s layout work
+            vehicle = f"{b['plate']} (H)" if is_h else b["plate"]
+            pdf.set_font("Helvetica", "B", 9)
+            pdf.text(x + (box_width - pdf.get_string_width(vehicle)) / 2, y + vehicle_baseline, vehicle)
+            pdf.set_font("Helvetica", "", 8)
+            key = (b['start'], b['end'])
+            date_entry = date_cache.get(key)
+            if date_entry is None:
+                date_line = f"{b['start']}-{b['end']} {month_name}"
+                date_entry = date_cache[key] = (date_line, (box_width - pdf.get_string_width(date_line)) / 2)
+            date_line, date_dx = date_entry
+            parts.append(f"{date_line}: {vehicle}")
+            pdf.text(x + date_dx, y + date_baseline, date_line)
+
+        return last_fill
+
+    return draw_row
+
 class CompactPDF(FPDF):
+    # (fill, text) colors for assigned vs backup/holiday boxes
+    ASSIGNED_COLORS = ((153, 255, 153), (20, 60, 20))  # light green fill
+    HOLIDAY_COLORS = ((255, 153, 153), (80, 30, 30))  # light red fill
+
+    # row drawers, one per box layout. Streamlit re-executes the script (and
+    # so redefines this class) on every rerun, so in practice this only
+    # lives for the document(s) built in one run.
+    _row_drawers = {}
+
+    def __init__(self, columns_per_row=4, **kwargs):
+        super().__init__(**kwargs)
+
+        # layout params, fixed for the whole document; the route boxes sit
+        # 15mm in from each edge, the legend and footer at the default margin
+        self.columns_per_row = columns_per_row
+        self.left_margin = 15
+        self.right_margin = 15
+        self.page_width = self.w - self.left_margin - self.right_margin
+        self.gap = 6  # horizontal gap between boxes
+        self.vgap = 6  # vertical gap between rows of boxes
+        self.box_height = 18
+        # text baselines inside a box (9pt vehicle line, 8pt date line),
+        # where a centered cell() at y+2 / y+10 would put them
+        self.vehicle_baseline = 2 + 5 / 2 + 0.3 * 9 / self.k
+        self.date_baseline = 10 + 4 / 2 + 0.3 * 8 / self.k
+
+        layout = (columns_per_row, self.left_margin, self.page_width, self.gap, self.box_height,
+                  self.vehicle_baseline, self.date_baseline, self.ASSIGNED_COLORS, self.HOLIDAY_COLORS)
+        if layout not in CompactPDF._row_drawers:
+            CompactPDF._row_drawers[layout] = make_row_drawer(*layout)
+        self._draw_row = CompactPDF._row_drawers[layout]
+
     def header(self):
-        # Title header
-        self.set_font("Arial", "B", 14)
-        self.cell(0, 8, "Krishna Dudh Vehicle Timetable", ln=True, align="C")
+        # Title header (always black, even if a page break happens mid-route)
+        self.set_text_color(0, 0, 0)
+        self.set_font("Helvetica", "B", 14)
+        self.cell(0, 8, "Krishna Dudh Vehicle Timetable", new_x=XPos.LMARGIN, new_y=YPos.NEXT, align="C")
         self.ln(2)
 
-    def draw_route_blocks_compact(self, route_name, blocks, month_name, columns_per_row=4):
+    def draw_route_blocks_compact(self, route_name, blocks, month_name, date_cache=None):
         """
-        Draw blocks in rows. columns_per_row controls how many boxes per row (default 4).
+        Draw blocks in rows of self.columns_per_row boxes (default 4).
         Does NOT alter block content/logic.
+        date_cache maps (start, end) -> (date line, centering offset) and can be
+        shared across routes, since many routes use the same date windows.
+        Returns the route's one-line text preview, built in the same pass.
         """
-        # some layout params
-        left_margin = 15
-        right_margin = 15
-        page_width = self.w - left_margin - right_margin
-        gap = 6  # horizontal gap between boxes
-        vgap = 6  # vertical gap between rows of boxes
-        box_height = 18
-
-        # compute box width such that 'columns_per_row' fit in page_width with gaps
-        box_width = (page_width - (columns_per_row - 1) * gap) / columns_per_row
+        if date_cache is None:
+            date_cache = {}
+        left_margin = self.left_margin
+        box_height = self.box_height
+        columns_per_row = self.columns_per_row
 
         # Title for route
-        self.set_font("Arial", "B", 12)
+        self.set_font("Helvetica", "B", 12)
         # ensure space before a route; if near bottom add page
         if self.get_y() > (self.h - 60):
             self.add_page()
         self.set_x(left_margin)
-        self.cell(0, 6, f"Route: {route_name}", ln=True)
+        self.cell(0, 6, f"Route: {route_name}", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
         self.ln(2)
 
-        # Prepare rows of boxes
-        rows = []
-        cur_row = []
-        for b in blocks:
-            cur_row.append(b)
-            if len(cur_row) == columns_per_row:
-                rows.append(cur_row)
-                cur_row = []
-        if cur_row:
-            rows.append(cur_row)
-
-        # Draw each row
-        for row in rows:
-            x = left_margin
+        # Draw rows of boxes as they are sliced off the blocks
+        # (collecting the text preview as we go)
+        parts = []
+        last_fill = None  # holiday marker of the last box drawn (None = colors not set yet)
+        it = iter(blocks)
+        while True:
+            row = list(islice(it, columns_per_row))
+            if not row:
+                break
             y = self.get_y()
-            max_box_height_in_row = box_height
-
-            for b in row:
-                # fill color based on holiday marker
-                if "(H)" in b["vehicle"]:
-                    self.set_fill_color(255, 153, 153)  # light red fill
-                    text_color = (80, 30, 30)
-                else:
-                    self.set_fill_color(153, 255, 153)  # light green fill
-                    text_color = (20, 60, 20)
-
-                # draw rect with fill
-                self.set_xy(x, y)
-                self.rect(x, y, box_width, max_box_height_in_row, style="DF")
-
-                # write centered text inside the box
-                self.set_xy(x + 1, y + 2)
-                self.set_text_color(*text_color)
-                self.set_font("Arial", "B", 9)
-                # vehicle line
-                # Use multi_cell but limit width to box_width-2, center alignment
-                self.multi_cell(box_width - 2, 5, b["vehicle"], border=0, align='C')
-                # date line (smaller)
-                self.set_font("Arial", "", 8)
-                date_line = f"{b['start']}-{b['end']} {month_name}"
-                # move cursor just below previous multi_cell for the same x
-                # To center date line we compute left offset
-                current_x = self.get_x()  # after multi_cell it moved; we will set back
-                self.set_xy(x + 1, y + 10)
-                self.multi_cell(box_width - 2, 4, date_line, border=0, align='C')
+            # rect()/text() don't trigger auto page breaks; keep the whole row together
+            if y + box_height > self.page_break_trigger:
+                self.add_page()
+                y = self.get_y()
 
-                # reset x to next box position
-                self.set_text_color(0, 0, 0)
-                x += box_width + gap
+            last_fill = self._draw_row(self, row, y, month_name, date_cache, parts, last_fill)
 
             # after finishing row, move Y to next row position
-            self.set_xy(left_margin, y + max_box_height_in_row + vgap)
+            self.set_xy(left_margin, y + box_height + self.vgap)
 
         # small gap after route
         self.ln(4)
-        # restore fill/text color defaults
+        # restore text color default for the next route title
         self.set_text_color(0, 0, 0)
 
-def generate_pdf_compact_arranged(timetable_blocks, month_name, year, file_path, columns_per_row=4):
-    pdf = CompactPDF(orientation='P', unit='mm', format='A4')
+        return " | ".join(parts)
+
+@st.cache_data(show_spinner=False)
+def generate_pdf_compact_arranged(timetable_blocks, month_name, year, columns_per_row=4):
+    pdf = CompactPDF(columns_per_row=columns_per_row, orientation='P', unit='mm', format='A4')
     pdf.set_auto_page_break(auto=True, margin=12)
+    pdf.set_compression(True)
     pdf.add_page()
-    pdf.set_font("Arial", "", 10)
 
-    # legend
-    pdf.set_font("Arial", "", 9)
-    pdf.cell(0, 5, f"Month: {month_name}   Year: {year}", ln=True)
+    # legend (one font for both lines)
+    pdf.set_font("Helvetica", "", 9)
+    pdf.cell(0, 5, f"Month: {month_name}   Year: {year}", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
     pdf.ln(2)
-    pdf.set_font("Arial", "", 9)
-    pdf.cell(0, 5, "Notation: Green = Assigned vehicle  |  Red = Backup/Holiday (H)", ln=True)
+    pdf.cell(0, 5, "Notation: Green = Assigned vehicle  |  Red = Backup/Holiday (H)", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
     pdf.ln(4)
 
+    # draw every route and collect its text preview in one pass;
+    # date labels repeat across routes, so format/measure each one only once.
+    # Routes are drawn sequentially on purpose: each route starts where the
+    # previous one ended (several routes share a page), so rendering routes
+    # as separate documents and merging them would change the layout.
+    preview = []
+    date_cache = {}
     for route, blocks in timetable_blocks.items():
-        pdf.draw_route_blocks_compact(route, blocks, month_name, columns_per_row=columns_per_row)
-    pdf.set_font("Arial","",10)
+        block_text = pdf.draw_route_blocks_compact(route, blocks, month_name, date_cache)
+        preview.append((route, block_text))
+    pdf.set_font("Helvetica","",10)
     pdf.cell(40, 8, "Date : ", border=0)
     pdf.ln(12)
-    pdf.set_font("Arial","",10)
     pdf.cell(40, 5, "Signature : ",border=0)
     pdf.ln(12)
     
-    pdf.output(file_path)
+    # build the document in memory (fpdf2 returns a bytearray)
+    pdf_bytes = bytes(pdf.output())
+    return pdf_bytes, preview
 
 # ----------------- Streamlit UI ----------------- #
 st.set_page_config(page_title="Krishna Dudh Vehicle Timetable", page_icon="🚛",layout="wide")
@@ -207,30 +295,32 @@ month_num = months.index(selected_month) + 1
 days_in_month = cal.monthrange(year, month_num)[1]
 
 if uploaded_file:
-    data = pd.read_excel(uploaded_file)
+    data = load_excel(uploaded_file.getvalue())
+
+    # validate once up front, so bad input stops here instead of failing inside the cached pipeline
+    route_count = data['RUTE NAME'].count()
+    vehicle_count = data['GADI_NUMBER'].count()
+    if route_count == 0 or vehicle_count == 0:
+        st.error("No vehicles: the Excel file needs at least one 'RUTE NAME' and one 'GADI_NUMBER'.")
+        st.stop()
+    if vehicle_count <= route_count:
+        st.warning("No backup vehicles: holidays will be shown as 'NONE (H)'.")
 
     if st.button("Generate Timetable"):
         # keep your block generation logic unchanged
-        timetable_blocks = generate_block_timetable(data, year, month_num)
+        timetable_blocks, fixed_vehicles = generate_block_timetable(data, year, month_num)
 
         # show compact textual preview in app
         st.subheader(f"Time Table preview - {selected_month} {year}")
-        for route, blocks in timetable_blocks.items():
-            block_text = " | ".join([f"{b['start']}-{b['end']} {selected_month}: {b['vehicle']}" for b in blocks])
-            st.markdown(f"**{route}** → {block_text}")
-
-        # generate and offer PDF download (4 columns per row)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-            generate_pdf_compact_arranged(timetable_blocks, selected_month, year, tmp_file.name, columns_per_row=4)
-            pdf_bytes = open(tmp_file.name, "rb").read()
-            st.download_button("⬇️ Download Timetable PDF", data=pdf_bytes,
-                               file_name=f"compact_timetable_{year}_{month_num}.pdf",
-                               mime="application/pdf")
-            # cleanup temp file
-            try:
-                os.remove(tmp_file.name)
-            except Exception:
-                pass
+
+        # generate PDF (4 columns per row) and the preview in one pass, then offer download
+        pdf_bytes, preview = generate_pdf_compact_arranged(timetable_blocks, selected_month, year, columns_per_row=4)
+        # one markdown element for all routes (one frontend message instead of one per route)
+        st.markdown("\n\n".join(f"**{route}** → {block_text}" for route, block_text in preview))
+        st.download_button("⬇️ Download Timetable PDF", data=pdf_bytes,
+                           file_name=f"compact_timetable_{year}_{month_num}.pdf",
+                           mime="application/pdf")
+        del pdf_bytes
 
                 # ---------- Generate Complete CSV Timetable ----------
         st.subheader("📥 Download Complete Monthly Timetable (CSV)")
@@ -242,27 +332,31 @@ if uploaded_file:
                     all_rows.append({
                         "Date": f"{year}-{month_num:02d}-{day:02d}",
                         "Route": route,
-                        "Vehicle": b["vehicle"].replace(" (H)", "")
+                        "Vehicle": b["plate"]
                     })
 
         full_timetable_df = pd.DataFrame(all_rows)
         st.dataframe(full_timetable_df)
 
-        csv_all = full_timetable_df.to_csv(index=False).encode('utf-8')
+        csv_all = to_csv_bytes(full_timetable_df)
         st.download_button("⬇️ Download Full Month Timetable (CSV)",
                            data=csv_all,
                            file_name=f"timetable_{year}_{month_num}.csv",
                            mime="text/csv")
+        del all_rows, full_timetable_df, csv_all
 
 
         # Summary
-        fixed_vehicles = data['GADI_NUMBER'].dropna().tolist()[:14]
         summary = generate_summary(timetable_blocks, fixed_vehicles, days_in_month)
         st.subheader("📊 Vehicle Work & Holiday Summary")
         st.dataframe(summary)
-        csv_summary = summary.to_csv(index=False).encode('utf-8')
+        csv_summary = to_csv_bytes(summary)
         st.download_button("⬇️ Download Vehicle Summary CSV", data=csv_summary,
                            file_name=f"summary_{year}_{month_num}.csv", mime="text/csv")
+
+        # release the workbook and timetable before the next rerun in this long-lived session
+        del data, timetable_blocks
+        gc.collect()
         
         
 